@@ -1,32 +1,19 @@
 import os
 import shutil
 import streamlit as st
-import atexit
-from code_indexer import index_files
+from code_indexer import index_file_contents, iter_batches
 from rag_engine import CodeRAG
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-# Define temp directory
-TEMP_DIR = "./temp"
+# Define data directory
 DATA_DIR = "./data"
 
-def cleanup_temp_files():
-    """Clean up temporary files"""
-    if os.path.exists(TEMP_DIR):
-        try:
-            shutil.rmtree(TEMP_DIR)
-            print(f"Cleaned up temporary files in {TEMP_DIR}")
-        except Exception as e:
-            print(f"Error cleaning up temp files: {str(e)}")
-
-# Register cleanup function to run on exit
-atexit.register(cleanup_temp_files)
+# File types accepted by the uploader, built once rather than on every rerun
+UPLOAD_TYPES = ("py", "js", "ts", "java", "c", "cpp", "h", "hpp", "cs", "go", "rb", "php", "html", "css")
 
-# Create temp directory if it doesn't exist
-os.makedirs(TEMP_DIR, exist_ok=True)
 os.makedirs(DATA_DIR, exist_ok=True)
 
 # Check if API key is set
@@ -49,35 +36,17 @@ def index_uploaded_files(uploaded_files):
     if not uploaded_files:
         return False
 
-    # Clean up the temp directory before adding new files
-    cleanup_temp_files()
-    os.makedirs(TEMP_DIR, exist_ok=True)
-
-    # Clear existing indexed files
-    st.session_state.rag.clear_collection()
-    st.session_state.indexed_files = []
-
-    temp_file_paths = []
+    st.session_state.indexed_files = [f.name for f in uploaded_files]
 
-    # Save uploaded files temporarily
-    for uploaded_file in uploaded_files:
-        file_path = os.path.join(TEMP_DIR, uploaded_file.name)
-
-        with open(file_path, "wb") as f:
-            f.write(uploaded_file.getbuffer())
-
-        temp_file_paths.append(file_path)
-        st.session_state.indexed_files.append(uploaded_file.name)
-
-    # Index files
-    code_elements = index_files(temp_file_paths)
-
-    # Add to vector database
-    if code_elements:
-        st.session_state.rag.add_documents(code_elements)
-        return True
+    # Index uploads straight from memory, no temp files needed
+    code_elements = index_file_contents(
+        [(uploaded_file.name, uploaded_file.getvalue()) for uploaded_file in uploaded_files]
+    )
 
-    return False
+    # Sync the vector database as files are parsed; unchanged elements keep
+    # their embeddings
+    indexed_count = st.session_state.rag.sync_documents(iter_batches(code_elements))
+    return indexed_count > 0
 
 def get_files_hash(files):
     """Create a hash of file names and modified times to detect changes"""
@@ -95,7 +64,7 @@ with st.sidebar:
     uploaded_files = st.file_uploader(
         "Upload code files",
         accept_multiple_files=True,
-        type=["py", "js", "ts", "java", "c", "cpp", "h", "hpp", "cs", "go", "rb", "php", "html", "css"]
+        type=UPLOAD_TYPES
     )
 
     # Auto-index when files change
@@ -154,9 +123,6 @@ with st.sidebar:
     # Add button to reset everything
     st.header("Reset App")
     if st.button("Reset Everything"):
-        # Clean up
-        cleanup_temp_files()
-
         # Close the current ChromaDB connection before deleting
         try:
             # Properly close the database connection
@@ -1,6 +1,12 @@
+import hashlib
+import logging
+import mmap
+import multiprocessing
 import os
-import uuid
-from typing import Dict, List, Any, Optional
+import pickle
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Any, Optional, Tuple, Union
 import process_files
 
 from tree_sitter_language_pack import (
@@ -8,44 +14,284 @@ from tree_sitter_language_pack import (
     get_parser as get_ts_parser,
     SupportedLanguage,
 )
-from tree_sitter import Language, Parser
+from tree_sitter import Language, Parser, Query
 
-LOADED_LANGUAGES: Dict[str, Language] = {}
-LOADED_PARSERS: Dict[str, Parser] = {}
+logger = logging.getLogger(__name__)
 
+# Source handed to the parser: file bytes or a read-only mmap of the file
+Buffer = Union[bytes, mmap.mmap]
 
-def get_language_and_parser(
-    lang_name: SupportedLanguage,
-) -> Optional[tuple[Language, Parser]]:
-    """Loads a tree-sitter language and parser using tree_sitter_language_pack."""
-    if lang_name not in LOADED_PARSERS:
+# Language and parser per language name, loaded once per process
+LOADED: Dict[str, Tuple[Language, Parser]] = {}
+LOADED_QUERIES: Dict[Tuple[str, Tuple[str, ...]], Query] = {}
+
+# Below this many files, forking a worker pool costs more than it saves.
+PARALLEL_MIN_FILES = 4
+
+# Forking the multi-threaded app process (Tornado, Chroma, ONNX threads) can
+# deadlock, so workers start from a clean forkserver (spawn where unavailable)
+POOL_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+# Bump when extraction output changes so stale cache entries are ignored.
+INDEXER_VERSION = 6
+INDEX_CACHE_PATH = os.path.join("data", "index_cache.sqlite3")
+
+# Filled on first use: process_files imports this module before it builds
+# LANGUAGE_LOOKUP, so the lookup can't be read at import time
+SUPPORTED_EXTENSIONS: Optional[frozenset[str]] = None
+
+# Elements per iter_batches batch, and the fewest new elements
+# sync_documents collects before an embedding request (except the last)
+EMBED_BATCH_SIZE = 96
+
+
+# --- Language-Specific Queries ---
+# These queries identify top-level functions and classes.
+# You'll need to refine these and add queries for other languages.
+# Split by scope so callers can run only the patterns they need.
+QUERIES: Dict[str, Dict[str, str]] = {
+    "python": {
+        "function": """
+            (function_definition name: (identifier) @function.name) @function.definition
+        """,
+        "class": """
+            (class_definition name: (identifier) @class.name) @class.definition
+        """,
+    },
+    "java": {
+        "function": """
+            (method_declaration name: (identifier) @function.name) @function.definition
+        """,
+        "class": """
+            (class_declaration name: (identifier) @class.name) @class.definition
+            (interface_declaration name: (identifier) @class.name) @class.definition
+        """,
+    },
+    "javascript": {
+        "function": """
+            (function_declaration name: (identifier) @function.name) @function.definition
+            (lexical_declaration (variable_declarator name: (identifier) @function.name value: [(arrow_function) (function_expression)])) @function.definition
+            (expression_statement (assignment_expression left: [(identifier) (member_expression)] @function.name right: [(arrow_function) (function_expression)])) @function.definition
+        """,
+        "class": """
+            (class_declaration name: (identifier) @class.name) @class.definition
+        """,
+    },
+    "c": {
+        "function": """
+            (function_definition declarator: (function_declarator declarator: (identifier) @function.name)) @function.definition
+        """,
+        "class": """
+            (struct_specifier name: (type_identifier) @class.name) @class.definition
+            (union_specifier name: (type_identifier) @class.name) @class.definition
+            (enum_specifier name: (type_identifier) @class.name) @class.definition
+        """,
+    },
+    "cpp": {
+        "function": """
+            (function_definition declarator: [
+                (function_declarator declarator: (identifier) @function.name)
+                (function_declarator declarator: (qualified_identifier name: (identifier) @function.name))
+                (function_declarator declarator: (field_identifier) @function.name) ; Methods
+             ]) @function.definition
+        """,
+        "class": """
+            (class_specifier name: (type_identifier) @class.name) @class.definition
+            (struct_specifier name: (type_identifier) @class.name) @class.definition
+            (union_specifier name: (type_identifier) @class.name) @class.definition
+            (enum_specifier name: (type_identifier) @class.name) @class.definition
+        """,
+    },
+    "csharp": {
+        "function": """
+            (method_declaration name: (identifier) @function.name) @function.definition
+        """,
+        "class": """
+            (class_declaration name: (identifier) @class.name) @class.definition
+            (struct_declaration name: (identifier) @class.name) @class.definition
+            (interface_declaration name: (identifier) @class.name) @class.definition
+            (enum_declaration name: (identifier) @class.name) @class.definition
+        """,
+    },
+    # Add queries for other languages supported by the pack
+}
+
+
+def get_supported_extensions() -> frozenset[str]:
+    """
+    Return the lower-cased extensions (and special file names such as
+    makefile) that have a language mapping, as matched by get_language_name.
+    """
+    global SUPPORTED_EXTENSIONS
+    if SUPPORTED_EXTENSIONS is None:
+        SUPPORTED_EXTENSIONS = frozenset(process_files.LANGUAGE_LOOKUP)
+    return SUPPORTED_EXTENSIONS
+
+
+def element_id(
+    code: str, file_path: str, kind: str, name: str, start_byte: int, end_byte: int
+) -> str:
+    """
+    Stable element ID, so re-indexing unchanged code yields the same ID.
+    The byte span tells apart identical definitions within one file, and the
+    name tells apart elements declared by one definition (const a = 1, b = 2).
+    """
+    key = f"{kind}\0{file_path}\0{name}\0{start_byte}-{end_byte}\0{code}".encode(
+        "utf-8", errors="ignore"
+    )
+    return hashlib.blake2b(key, digest_size=12).hexdigest()
+
+
+class IndexCache:
+    """
+    On-disk cache of extracted elements. Each entry is stored under a source
+    name and validated against a key: stat info for files on disk, a content
+    hash for in-memory sources.
+
+    Entries live in a SQLite table, so a run only reads the entries it asks
+    for and only writes the ones that changed. Each write commits on its own,
+    so no lock is held while the caller embeds elements between files.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn: Optional[sqlite3.Connection] = None
         try:
-            # Use the functions from the language pack
-            language = get_ts_language(lang_name)
-            parser = get_ts_parser(lang_name)
-            LOADED_LANGUAGES[lang_name] = language
-            LOADED_PARSERS[lang_name] = parser
-        except LookupError:
-            print(
-                f"Warning: Language '{lang_name}' not supported by tree_sitter_language_pack."
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            # Autocommit, with WAL so readers never wait on a concurrent run
+            self.conn = sqlite3.connect(path, isolation_level=None)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries"
+                " (source TEXT PRIMARY KEY, key BLOB, elements BLOB)"
             )
-            return None
         except Exception as e:
-            print(f"Warning: Could not load language '{lang_name}' using pack: {e}")
+            logger.warning("Index cache %s unavailable: %s", path, e)
+            self.close()
+
+    @staticmethod
+    def stat_key(file_path: str) -> Optional[tuple]:
+        try:
+            st = os.stat(file_path)
+        except OSError:
             return None
-    return LOADED_LANGUAGES.get(lang_name), LOADED_PARSERS.get(lang_name)
+        return (st.st_size, st.st_mtime_ns, INDEXER_VERSION)
+
+    @staticmethod
+    def content_key(content: bytes) -> tuple:
+        # blake2b runs far faster than a parse, so hashing every upload is cheap
+        return (hashlib.blake2b(content, digest_size=16).digest(), INDEXER_VERSION)
+
+    def get(self, source: str, key: tuple) -> Optional[List[Dict[str, Any]]]:
+        if self.conn is None:
+            return None
+        try:
+            row = self.conn.execute(
+                "SELECT key, elements FROM entries WHERE source = ?", (source,)
+            ).fetchone()
+            if row is not None and pickle.loads(row[0]) == key:
+                return pickle.loads(row[1])
+        except Exception as e:
+            logger.warning("Ignoring unreadable index cache entry %s: %s", source, e)
+        return None
+
+    def put(self, source: str, key: tuple, elements: List[Dict[str, Any]]):
+        if self.conn is None:
+            return
+        # One entry per source, so re-indexing an edited file replaces it
+        try:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO entries (source, key, elements) VALUES (?, ?, ?)",
+                (
+                    source,
+                    pickle.dumps(key, protocol=pickle.HIGHEST_PROTOCOL),
+                    pickle.dumps(elements, protocol=pickle.HIGHEST_PROTOCOL),
+                ),
+            )
+        except Exception as e:
+            logger.warning("Could not write index cache entry %s: %s", source, e)
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+def get_language_and_parser(
+    lang_name: SupportedLanguage,
+) -> Optional[tuple[Language, Parser]]:
+    """Loads a tree-sitter language and parser using tree_sitter_language_pack."""
+    loaded = LOADED.get(lang_name)
+    if loaded is not None:
+        return loaded
+
+    try:
+        # Use the functions from the language pack
+        loaded = LOADED[lang_name] = (
+            get_ts_language(lang_name),
+            get_ts_parser(lang_name),
+        )
+    except LookupError:
+        logger.warning(
+            "Language '%s' not supported by tree_sitter_language_pack.", lang_name
+        )
+        return None
+    except Exception as e:
+        logger.warning("Could not load language '%s' using pack: %s", lang_name, e)
+        return None
+    return loaded
 
 
 def extract_elements_with_tree_sitter(
-    file_path: str, language_name: SupportedLanguage
-) -> List[Dict[str, Any]]:
+    file_path: str,
+    language_name: SupportedLanguage,
+    scopes: Optional[Iterable[str]] = None,
+) -> Optional[List[Dict[str, Any]]]:
     """
     Parse a file using tree-sitter and extract meaningful code elements.
+    scopes limits extraction to e.g. {"function"}; None extracts everything.
+    Returns None if the file could not be read or parsed.
+    """
+    try:
+        with open(file_path, "rb") as f:
+            # mmap can't map an empty file
+            if os.fstat(f.fileno()).st_size == 0:
+                return extract_elements_from_source(
+                    file_path, b"", language_name, scopes
+                )
+
+            # Let the parser read the mapped pages directly instead of copying
+            # the file into a bytes object; elements are decoded before unmap
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return extract_elements_from_source(
+                    file_path, mm, language_name, scopes
+                )
+    except Exception as e:
+        logger.error("Error reading %s: %s", file_path, e)
+        return None
+
+
+def extract_elements_from_source(
+    file_path: str,
+    content_bytes: Buffer,
+    language_name: SupportedLanguage,
+    scopes: Optional[Iterable[str]] = None,
+) -> Optional[List[Dict[str, Any]]]:
+    """
+    Parse in-memory source using tree-sitter and extract meaningful code elements.
+    content_bytes may be bytes or any buffer such as an mmap; file_path is
+    only used to label the elements. scopes limits extraction to e.g.
+    {"function"}; None extracts every scope defined for the language.
+    Returns None if parsing or querying failed.
     """
     lang_parser_tuple = get_language_and_parser(language_name)
     if not lang_parser_tuple:
-        print(
-            f"Skipping {file_path}: Language '{language_name}' not supported or loaded via pack."
+        logger.warning(
+            "Skipping %s: Language '%s' not supported or loaded via pack.",
+            file_path,
+            language_name,
         )
         return []  # Or fallback
 
@@ -56,151 +302,225 @@ def extract_elements_with_tree_sitter(
 
     elements = []
     try:
-        with open(file_path, "rb") as f:
-            content_bytes = f.read()
-
         tree = parser.parse(content_bytes)
         root_node = tree.root_node
 
-        # --- Language-Specific Queries ---
-        # These queries identify top-level functions and classes.
-        # You'll need to refine these and add queries for other languages.
-        queries = {
-            "python": """
-                (function_definition name: (identifier) @function.name) @function.definition
-                (class_definition name: (identifier) @class.name) @class.definition
-            """,
-            "java": """
-                (method_declaration name: (identifier) @function.name) @function.definition
-                (class_declaration name: (identifier) @class.name) @class.definition
-                (interface_declaration name: (identifier) @class.name) @class.definition
-            """,
-            "javascript": """
-                (function_declaration name: (identifier) @function.name) @function.definition
-                (lexical_declaration (variable_declarator name: (identifier) @function.name value: [(arrow_function) (function)])) @function.definition
-                (expression_statement (assignment_expression left: [(identifier) (member_expression)] @function.name right: [(arrow_function) (function)])) @function.definition
-                (class_declaration name: (identifier) @class.name) @class.definition
-             """,
-            "c": """
-                (function_definition declarator: (function_declarator declarator: (identifier) @function.name)) @function.definition
-                (struct_specifier name: (type_identifier) @class.name) @class.definition
-                (union_specifier name: (type_identifier) @class.name) @class.definition
-                (enum_specifier name: (type_identifier) @class.name) @class.definition
-             """,
-            "cpp": """
-                (function_definition declarator: [
-                    (function_declarator declarator: (identifier) @function.name)
-                    (function_declarator declarator: (qualified_identifier name: (identifier) @function.name))
-                    (function_declarator declarator: (field_identifier) @function.name) # Methods
-                 ]) @function.definition
-                (class_specifier name: (type_identifier) @class.name) @class.definition
-                (struct_specifier name: (type_identifier) @class.name) @class.definition
-                (union_specifier name: (type_identifier) @class.name) @class.definition
-                (enum_specifier name: (type_identifier) @class.name) @class.definition
-             """,
-            "csharp": """
-                (method_declaration name: (identifier) @function.name) @function.definition
-                (class_declaration name: (identifier) @class.name) @class.definition
-                (struct_declaration name: (identifier) @class.name) @class.definition
-                (interface_declaration name: (identifier) @class.name) @class.definition
-                (enum_declaration name: (identifier) @class.name) @class.definition
-             """,
-            # Add queries for other languages supported by the pack
-        }
-
-        query_string = queries.get(language_name)
-        if not query_string:
-            print(
-                f"Warning: No tree-sitter query defined for language '{language_name}'. Falling back to basic chunking."
+        language_queries = QUERIES.get(language_name)
+        if not language_queries:
+            logger.warning(
+                "No tree-sitter query defined for language '%s'. Falling back to basic chunking.",
+                language_name,
             )
             # Optionally fall back to process_non_python_file or just return []
             # return process_non_python_file(file_path) # Fallback example
             return []
 
-        query = language.query(query_string)
-        captures_dict = query.captures(root_node)  # Rename to captures_dict
-
-        # --- DEBUGGING: Print captures ---
-        print(f"--- Captures Dict for {file_path} ({language_name}) ---")
-        print(captures_dict)
-        print(f"--- End Captures Dict ---")
-        # --- END DEBUGGING ---
+        if scopes is None:
+            scope_names = tuple(language_queries)
+        elif isinstance(scopes, str):
+            # A bare "function" would otherwise be read as a set of letters
+            scope_names = (scopes,) if scopes in language_queries else ()
+        else:
+            scope_names = tuple(sorted(set(scopes) & set(language_queries)))
+        if not scope_names:
+            return []
 
-        processed_definition_nodes = set()  # Keep track of processed definitions
+        # Compile each (language, scopes) query once per process; all
+        # requested scopes go into one query so the tree is matched once
+        query_key = (language_name, scope_names)
+        query = LOADED_QUERIES.get(query_key)
+        if query is None:
+            query = LOADED_QUERIES[query_key] = language.query(
+                "\n".join(language_queries[scope] for scope in scope_names)
+            )
+        # Each match groups a definition with its own name capture
+        matches = query.matches(root_node)
 
-        # Iterate through capture types relevant for definitions (e.g., function.definition, class.definition)
-        for capture_name, definition_nodes in captures_dict.items():
-            if not capture_name.endswith(".definition"):
-                continue  # Skip if it's not a definition capture type (like .name)
+        # Lazy %-formatting: the matches are only stringified when DEBUG is on
+        logger.debug("Matches for %s (%s): %s", file_path, language_name, matches)
 
-            element_type_base = capture_name.split(".")[0]  # 'function' or 'class'
-            name_capture_key = f"{element_type_base}.name"  # Corresponding name key
+        file_name = os.path.basename(file_path)
+        # One element per match, so each name declared by a shared definition
+        # (const g = ..., h = ...) gets its own element; the same definition
+        # and name matched again is skipped, keeping element IDs unique
+        processed_definitions = set()
+        for _pattern_index, match_captures in matches:
+            for capture_name, definition_nodes in match_captures.items():
+                if not capture_name.endswith(".definition"):
+                    continue  # The .name capture is read alongside its definition
 
-            name_nodes = captures_dict.get(
-                name_capture_key, []
-            )  # Get the list of name nodes
+                element_type = capture_name.split(".")[0]  # 'function' or 'class'
+                name_nodes = match_captures.get(f"{element_type}.name")
+                # Slice the source buffer directly rather than going through
+                # node.text, which fetches the bytes back from the tree
+                element_name = "Unknown"
+                if name_nodes:
+                    name_node = name_nodes[0]
+                    element_name = content_bytes[
+                        name_node.start_byte : name_node.end_byte
+                    ].decode("utf-8", errors="ignore")
 
-            for definition_node in definition_nodes:
-                if definition_node.id in processed_definition_nodes:
+                definition_node = definition_nodes[0]
+                definition_key = (element_type, definition_node.id, element_name)
+                if definition_key in processed_definitions:
                     continue
+                processed_definitions.add(definition_key)
 
-                element_name = "Unknown"
-                # Find the corresponding name node for this specific definition node
-                for name_node in name_nodes:
-                    # Check if the name node is within the byte range of the definition node
-                    if (
-                        name_node.start_byte >= definition_node.start_byte
-                        and name_node.end_byte <= definition_node.end_byte
-                    ):
-                        element_name = name_node.text.decode("utf-8", errors="ignore")
-                        break  # Found the name for this definition
-
-                element_type = element_type_base  # Use 'function' or 'class' directly
-
-                # Now create the element dictionary
-                code_segment = definition_node.text.decode("utf-8", errors="ignore")
+                code_segment = content_bytes[
+                    definition_node.start_byte : definition_node.end_byte
+                ].decode("utf-8", errors="ignore")
                 start_line = definition_node.start_point[0] + 1
                 end_line = definition_node.end_point[0] + 1
+                line_range = f"{start_line}-{end_line}"
 
                 elements.append(
                     {
-                        "id": str(uuid.uuid4()),
+                        "id": element_id(
+                            code_segment,
+                            file_path,
+                            element_type,
+                            element_name,
+                            definition_node.start_byte,
+                            definition_node.end_byte,
+                        ),
                         "type": element_type,
                         "name": element_name,
                         "code": code_segment,
                         "file_path": file_path,
-                        "line_range": f"{start_line}-{end_line}",
-                        "description": f"{element_type.capitalize()} {element_name} from {os.path.basename(file_path)}",
+                        "line_range": line_range,
+                        "description": f"{element_type.capitalize()} {element_name} from {file_name}",
                     }
                 )
-                processed_definition_nodes.add(
-                    definition_node.id
-                )  # Mark this definition as processed
 
         # If no specific elements found, maybe chunk the whole file?
-        if not elements and content_bytes.strip():
-            print(
-                f"No specific elements found via query in {file_path} for {language_name}. Consider adding a whole-file chunk or refining queries."
+        # A root with no children means the source was empty or whitespace
+        if not elements and root_node.child_count:
+            logger.info(
+                "No specific elements found via query in %s for %s. Consider adding a whole-file chunk or refining queries.",
+                file_path,
+                language_name,
             )
             # Optionally add a single chunk for the whole file here
             # elements.extend(process_non_python_file(file_path))
 
     except Exception as e:
-        print(f"Error processing {file_path} with tree-sitter pack: {str(e)}")
+        logger.error("Error processing %s with tree-sitter pack: %s", file_path, e)
         # Optionally fall back to basic chunking on error
         # return process_non_python_file(file_path)
-        return []
+        return None
 
     return elements
 
 
-def index_files(file_paths: List[str]) -> List[Dict[str, Any]]:
+def map_files(worker, *iterables) -> Iterator[Optional[List[Dict[str, Any]]]]:
+    """
+    Yield worker's extracted elements (None on failure) for each file, in order.
+    Files are parsed in a process pool when there are enough of them.
+    """
+    if len(iterables[0]) < PARALLEL_MIN_FILES:
+        yield from map(worker, *iterables)
+        return
+
+    # Each worker warms its own LOADED cache on first use
+    with ProcessPoolExecutor(
+        max_workers=os.cpu_count(), mp_context=POOL_CONTEXT
+    ) as executor:
+        yield from executor.map(worker, *iterables, chunksize=8)
+
+
+def index_cached(
+    cache: Optional[IndexCache],
+    sources: List[str],
+    keys: List[Optional[tuple]],
+    worker,
+    *iterables,
+) -> Iterator[Dict[str, Any]]:
     """
-    Index multiple files and return all code elements.
+    Yield elements for each source, serving cache hits directly and parsing
+    only the misses through map_files(worker, *iterables). Sources that fail
+    to parse yield nothing and are not cached, so the next run retries them.
     """
-    all_elements = []
-    for file_path in file_paths:
-        elements = process_files.process_file(file_path)
-        all_elements.extend(elements)
+    pending = []
+    for i, (source, key) in enumerate(zip(sources, keys)):
+        elements = cache.get(source, key) if cache is not None and key else None
+        if elements is None:
+            pending.append(i)
+        else:
+            yield from elements
 
-    return all_elements
+    try:
+        pending_args = [[items[i] for i in pending] for items in iterables]
+        for i, elements in zip(pending, map_files(worker, *pending_args)):
+            if elements is None:
+                continue
+            if cache is not None and keys[i]:
+                cache.put(sources[i], keys[i], elements)
+            yield from elements
+    finally:
+        if cache is not None:
+            cache.close()
+
+
+def index_files(
+    file_paths: Iterable[str], cache_path: Optional[str] = INDEX_CACHE_PATH
+) -> Iterator[Dict[str, Any]]:
+    """
+    Index multiple files, yielding code elements as each file is parsed.
+    Files unchanged since the last run are served from the index cache;
+    pass cache_path=None to always re-parse.
+    """
+    file_paths = list(file_paths)
+    cache = IndexCache(cache_path) if cache_path else None
+    sources = [os.path.abspath(file_path) for file_path in file_paths]
+    keys = [IndexCache.stat_key(file_path) if cache else None for file_path in file_paths]
+    yield from index_cached(
+        cache, sources, keys, process_files.process_file, file_paths
+    )
+
+
+def index_file_contents(
+    files: Iterable[Tuple[str, bytes]], cache_path: Optional[str] = INDEX_CACHE_PATH
+) -> Iterator[Dict[str, Any]]:
+    """
+    Index in-memory (name, content) pairs, e.g. uploads, without touching disk.
+    Elements are yielded as each file is parsed; content seen before under
+    the same name is served from the index cache by its hash.
+    """
+    files = list(files)
+    cache = IndexCache(cache_path) if cache_path else None
+    names = [name for name, _ in files]
+    contents = [content for _, content in files]
+    # Prefixed so names can't collide with the absolute paths of index_files
+    sources = [f"contents:{name}" for name in names]
+    keys = [IndexCache.content_key(content) if cache else None for content in contents]
+    yield from index_cached(
+        cache, sources, keys, process_files.process_file_bytes, names, contents
+    )
+
+
+def batch_by_length(
+    elements: List[Dict[str, Any]], batch_size: int
+) -> Iterator[List[Dict[str, Any]]]:
+    """Split elements into batches after ordering them by code length."""
+    ordered = sorted(elements, key=lambda element: len(element["code"]))
+    for i in range(0, len(ordered), batch_size):
+        yield ordered[i : i + batch_size]
+
+
+def iter_batches(
+    elements: Iterable[Dict[str, Any]],
+    batch_size: int = EMBED_BATCH_SIZE,
+    window: int = 8,
+) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Yield fixed-size batches of elements for batched embedding.
+    Elements are buffered `window` batches at a time and ordered by code
+    length, so batches pad to similar sizes while parsing is still running.
+    """
+    buffer = []
+    for element in elements:
+        buffer.append(element)
+        if len(buffer) >= batch_size * window:
+            yield from batch_by_length(buffer, batch_size)
+            buffer = []
+    yield from batch_by_length(buffer, batch_size)
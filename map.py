@@ -61,7 +61,6 @@ LANGUAGE_MAP: Dict[str, SupportedLanguage] = {
     ".proto": "proto",
     # Scripting
     ".ps1": "powershell",
-    ".jl": "julia",
     ".tcl": "tcl",
     ".m": "matlab",
     # Shell configurations
@@ -1,46 +1,98 @@
 from map import LANGUAGE_MAP
+import logging
 import os
-import uuid
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
+from tree_sitter_language_pack import SupportedLanguage
 import code_indexer
+
+logger = logging.getLogger(__name__)
+
+# LANGUAGE_MAP with lower-cased keys, so lookups need a single .lower() per path
+LANGUAGE_LOOKUP: Dict[str, SupportedLanguage] = {
+    key.lower(): lang_name for key, lang_name in LANGUAGE_MAP.items()
+}
+
+
 def process_non_python_file(file_path: str) -> List[Dict[str, Any]]:
     """Process non-Python files by chunking them appropriately"""
-    try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            content = f.read()
 
-        # For simplicity, chunk by logical sections if possible
-        # Basic chunking strategy - can be improved based on file type
-        chunks = []
-        lines = content.split("\n")
+    file_name = os.path.basename(file_path)
 
-        # Create chunks of max ~100 lines
+    def make_chunk(start_line: int, end_line: int, start_byte: int, lines: List[bytes]):
+        chunk_bytes = b"".join(lines)
+        chunk_content = chunk_bytes.decode("utf-8")
+        if chunk_content.endswith("\n"):
+            chunk_content = chunk_content[:-1]
+        if not chunk_content.strip():
+            return None
+        line_range = f"{start_line}-{end_line}"
+        return {
+            "id": code_indexer.element_id(
+                chunk_content, file_path, "code_chunk", "", start_byte, start_byte + len(chunk_bytes)
+            ),
+            "type": "code_chunk",
+            "code": chunk_content,
+            "file_path": file_path,
+            "line_range": line_range,
+            "description": f"Code chunk (lines {start_line}-{end_line}) from {file_name}",
+        }
+
+    try:
+        chunks = []
+        # Create chunks of max ~100 lines, reading line by line so only the
+        # current chunk is ever held in memory
         chunk_size = 100
-        for i in range(0, len(lines), chunk_size):
-            chunk_content = "\n".join(lines[i : i + chunk_size])
-            if chunk_content.strip():
-                chunks.append(
-                    {
-                        "id": str(uuid.uuid4()),
-                        "type": "code_chunk",
-                        "code": chunk_content,
-                        "file_path": file_path,
-                        "line_range": f"{i+1}-{min(i+chunk_size, len(lines))}",
-                        "description": f"Code chunk (lines {i+1}-{min(i+chunk_size, len(lines))}) from {os.path.basename(file_path)}",
-                    }
-                )
+        buffer = []
+        start_line = 1
+        start_byte = 0
+        with open(file_path, "rb") as f:
+            for line_number, line in enumerate(f, 1):
+                buffer.append(line)
+                if len(buffer) == chunk_size:
+                    chunk = make_chunk(start_line, line_number, start_byte, buffer)
+                    if chunk:
+                        chunks.append(chunk)
+                    start_byte += sum(len(buffered) for buffered in buffer)
+                    buffer = []
+                    start_line = line_number + 1
+
+        if buffer:
+            chunk = make_chunk(start_line, start_line + len(buffer) - 1, start_byte, buffer)
+            if chunk:
+                chunks.append(chunk)
 
         return chunks
 
     except Exception as e:
-        print(f"Error processing {file_path}: {str(e)}")
+        logger.error("Error processing %s: %s", file_path, e)
         return []
 
 
-def process_file(file_path: str) -> List[Dict[str, Any]]:
-    """Process a single file based on its extension using tree-sitter if available."""
-    _, ext = os.path.splitext(file_path)
-    lang_name = LANGUAGE_MAP.get(ext.lower())
+def get_language_name(file_path: str) -> Optional[SupportedLanguage]:
+    """Map a file name to its tree-sitter language, or None if unsupported."""
+    name = os.path.basename(file_path).lower()
+
+    # Whole-name entries: Dockerfile, Makefile, .gitignore, .bashrc, ...
+    lang_name = LANGUAGE_LOOKUP.get(name)
+    if lang_name:
+        return lang_name
+
+    # Try the longest suffix first so .blade.php wins over .php
+    dot = name.find(".")
+    while dot != -1:
+        lang_name = LANGUAGE_LOOKUP.get(name[dot:])
+        if lang_name:
+            return lang_name
+        dot = name.find(".", dot + 1)
+    return None
+
+
+def process_file(file_path: str) -> Optional[List[Dict[str, Any]]]:
+    """
+    Process a single file based on its name using tree-sitter if available.
+    Returns None if the file could not be read or parsed.
+    """
+    lang_name = get_language_name(file_path)
 
     if lang_name:
         # Try processing with tree-sitter via the language pack
@@ -48,6 +100,20 @@ def process_file(file_path: str) -> List[Dict[str, Any]]:
         return code_indexer.extract_elements_with_tree_sitter(file_path, lang_name)
     else:
         # Fallback for unsupported or non-code files
-        print(f"No specific parser mapped for extension '{ext}'. Skipping {file_path}.")
+        logger.info("No specific parser mapped for %s. Skipping it.", file_path)
         # return process_non_python_file(file_path) # Or just return empty
         return []
+
+
+def process_file_bytes(name: str, content: bytes) -> Optional[List[Dict[str, Any]]]:
+    """
+    Process in-memory file content based on its name.
+    Returns None if the content could not be parsed.
+    """
+    lang_name = get_language_name(name)
+
+    if lang_name:
+        return code_indexer.extract_elements_from_source(name, content, lang_name)
+    else:
+        logger.info("No specific parser mapped for %s. Skipping it.", name)
+        return []
@@ -1,8 +1,13 @@
 import os
+import asyncio
 import chromadb
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 import google.generativeai as genai
-from typing import List, Dict, Any, Tuple
+from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
+from typing import Iterable, List, Dict, Any, Optional, Tuple
 from dotenv import load_dotenv
+from code_indexer import EMBED_BATCH_SIZE
 
 # Load environment variables
 load_dotenv()
@@ -11,7 +16,21 @@ load_dotenv()
 API_KEY = os.getenv("GEMINI_API_KEY")
 genai.configure(api_key=API_KEY)
 
+# Queries whose embeddings are at least this cosine-similar to an earlier
+# query reuse its answer instead of re-running retrieval and Gemini
+QUERY_CACHE_THRESHOLD = 0.97
+QUERY_CACHE_SIZE = 256
+
 class CodeRAG:
+    # Static parts of the Gemini prompt; context and query go between them
+    PROMPT_PRE = (
+        "You are a helpful AI assistant specialized in answering questions about code.\n"
+        "Please answer the following question based on the code context provided.\n\n"
+        "Code context:\n"
+    )
+    PROMPT_MID = "\n\nQuestion: "
+    PROMPT_POST = "\n\nGive a detailed and helpful response, referencing specific parts of the code where relevant.\n"
+
     def __init__(self, persist_directory="./data"):
         """Initialize the RAG engine with ChromaDB."""
         self.persist_directory = persist_directory
@@ -20,29 +39,51 @@ class CodeRAG:
         # Initialize ChromaDB
         self.client = chromadb.PersistentClient(path=persist_directory)
 
+        # Held explicitly so queries can be embedded once and reused
+        self.embedding_function = DefaultEmbeddingFunction()
+
         # Create or get collection
         try:
-            self.collection = self.client.get_collection(name="code_snippets")
+            self.collection = self.client.get_collection(
+                name="code_snippets",
+                embedding_function=self.embedding_function
+            )
             print("Using existing collection")
         except Exception:
             print("Creating new collection")
             self.collection = self.client.create_collection(
                 name="code_snippets",
-                metadata={"hnsw:space": "cosine"}
+                metadata={"hnsw:space": "cosine"},
+                embedding_function=self.embedding_function
             )
 
+        # Semantic cache of answered queries: a matrix of unit-length query
+        # embeddings with (n_results, answer) entries for each row
+        self.query_cache_embeddings = None
+        self.query_cache_entries = []
+
         # Initialize Gemini model - using the 2.0 Flash model
         self.model = genai.GenerativeModel('gemini-2.0-flash')
 
-    def add_documents(self, code_elements: List[Dict[str, Any]]) -> None:
+    @staticmethod
+    def document_text(element: Dict[str, Any]) -> str:
+        """The text stored and embedded for a code element."""
+        return f"{element['description']}\n{element['code']}"
+
+    def embed_documents(self, code_elements: List[Dict[str, Any]]) -> List[np.ndarray]:
+        """Embed code elements the way the collection would."""
+        return self.embedding_function([self.document_text(element) for element in code_elements])
+
+    def add_documents(self, code_elements: List[Dict[str, Any]], embeddings: Optional[List[np.ndarray]] = None) -> None:
         """
         Add code elements to the vector database.
+        Pass embeddings (from embed_documents) to skip embedding them again.
         """
         if not code_elements:
             return
 
         ids = [element["id"] for element in code_elements]
-        documents = [f"{element['description']}\n{element['code']}" for element in code_elements]
+        documents = [self.document_text(element) for element in code_elements]
         metadatas = [{
             "type": element["type"],
             "file_path": element["file_path"],
@@ -50,15 +91,67 @@ class CodeRAG:
             "description": element["description"],
         } for element in code_elements]
 
-        # Add to collection
-        self.collection.add(
-            ids=ids,
-            documents=documents,
-            metadatas=metadatas
-        )
+        # Add to collection, within the client's per-request limit
+        max_batch_size = self.client.get_max_batch_size()
+        for start in range(0, len(ids), max_batch_size):
+            end = start + max_batch_size
+            self.collection.add(
+                ids=ids[start:end],
+                documents=documents[start:end],
+                metadatas=metadatas[start:end],
+                embeddings=embeddings[start:end] if embeddings is not None else None
+            )
 
+        self.clear_query_cache()
         print(f"Added {len(code_elements)} code elements to the database.")
 
+    def sync_documents(self, batches: Iterable[List[Dict[str, Any]]]) -> int:
+        """
+        Make the collection hold exactly the given code elements.
+        Element IDs are content hashes, so only new elements are embedded and
+        added; they are collected across incoming batches and added once at
+        least EMBED_BATCH_SIZE are pending, so a mostly unchanged re-index
+        doesn't issue many tiny adds. Elements no longer present are deleted.
+        Returns the number of distinct elements.
+        """
+        existing_ids = set(self.collection.get(include=[])["ids"])
+        seen_ids = set()
+
+        def new_element_groups():
+            new_elements = []
+            for batch in batches:
+                for element in batch:
+                    if element["id"] in seen_ids:
+                        continue
+                    seen_ids.add(element["id"])
+                    if element["id"] not in existing_ids:
+                        new_elements.append(element)
+                if len(new_elements) >= EMBED_BATCH_SIZE:
+                    yield new_elements
+                    new_elements = []
+            if new_elements:
+                yield new_elements
+
+        # Embed each group in a worker thread while the previous one is written,
+        # keeping a single group in flight
+        with ThreadPoolExecutor(max_workers=1) as embedder:
+            pending = None
+            for group in new_element_groups():
+                future = embedder.submit(self.embed_documents, group)
+                if pending:
+                    self.add_documents(pending[0], pending[1].result())
+                pending = (group, future)
+            if pending:
+                self.add_documents(pending[0], pending[1].result())
+
+        stale_ids = list(existing_ids - seen_ids)
+        if stale_ids:
+            self.collection.delete(ids=stale_ids)
+            self.clear_query_cache()
+            print(f"Removed {len(stale_ids)} stale code elements from the database.")
+
+        return len(seen_ids)
+
     def clear_collection(self):
         """Clear all documents from the collection by recreating it"""
         try:
@@ -69,23 +162,70 @@ class CodeRAG:
             # Create a new empty collection
             self.collection = self.client.create_collection(
                 name="code_snippets",
-                metadata={"hnsw:space": "cosine"}
+                metadata={"hnsw:space": "cosine"},
+                embedding_function=self.embedding_function
             )
+            self.clear_query_cache()
             print("Created new empty collection")
             return True
         except Exception as e:
             print(f"Error clearing collection: {str(e)}")
             return False
 
-    def search(self, query: str, n_results: int = 5) -> List[Dict[str, Any]]:
+    def clear_query_cache(self):
+        """Forget cached answers, e.g. after the indexed code changed"""
+        self.query_cache_embeddings = None
+        self.query_cache_entries = []
+
+    def lookup_query_cache(self, query_embedding: np.ndarray, n_results: int) -> Optional[Tuple[str, str]]:
+        """
+        Return the cached answer of a semantically equivalent earlier query.
+        query_embedding must be unit length, like the cached rows, so cosine
+        similarity is a single matrix-vector product.
+        """
+        if self.query_cache_embeddings is None:
+            return None
+
+        similarities = self.query_cache_embeddings @ query_embedding
+        for i in np.argsort(-similarities):
+            if similarities[i] < QUERY_CACHE_THRESHOLD:
+                break
+            cached_n_results, answer = self.query_cache_entries[i]
+            if cached_n_results == n_results:
+                return answer
+        return None
+
+    def store_query_cache(self, query_embedding: np.ndarray, n_results: int, answer: Tuple[str, str]):
+        """
+        Remember an answer for a unit-length query embedding, evicting the
+        oldest once the cache is full.
+        """
+        if self.query_cache_embeddings is None:
+            self.query_cache_embeddings = query_embedding[np.newaxis, :]
+        else:
+            self.query_cache_embeddings = np.vstack([self.query_cache_embeddings, query_embedding])
+        self.query_cache_entries.append((n_results, answer))
+
+        if len(self.query_cache_entries) > QUERY_CACHE_SIZE:
+            self.query_cache_embeddings = self.query_cache_embeddings[1:]
+            del self.query_cache_entries[0]
+
+    def search(self, query: str, n_results: int = 5, query_embedding: Optional[np.ndarray] = None) -> List[Dict[str, Any]]:
         """
         Search for relevant code elements based on query.
+        Pass query_embedding to reuse an embedding that was already computed.
         """
         try:
-            results = self.collection.query(
-                query_texts=[query],
-                n_results=n_results,
-            )
+            if query_embedding is not None:
+                results = self.collection.query(
+                    query_embeddings=[query_embedding],
+                    n_results=n_results,
+                )
+            else:
+                results = self.collection.query(
+                    query_texts=[query],
+                    n_results=n_results,
+                )
 
             if not results["ids"] or len(results["ids"][0]) == 0:
                 return []
@@ -99,44 +239,149 @@ class CodeRAG:
             print(f"Error during search: {str(e)}")
             return []
 
-    def generate_response(self, query: str, context_docs: List[Dict[str, Any]]) -> Tuple[str, str]:
+    def search_batch(self, query_embeddings: List[np.ndarray], n_results: int = 5) -> List[List[Dict[str, Any]]]:
         """
-        Generate a response using Gemini API based on query and retrieved context.
-        Returns both the response and the context sent to Gemini.
+        Search for several already-embedded queries in a single collection query.
+        Returns one result list per query.
         """
-        if not context_docs:
-            return "No relevant code found to answer your question.", "No context available."
+        try:
+            results = self.collection.query(
+                query_embeddings=query_embeddings,
+                n_results=n_results,
+            )
+
+            return [[{
+                "id": ids[i],
+                "document": results["documents"][q][i],
+                "metadata": results["metadatas"][q][i],
+            } for i in range(len(ids))] for q, ids in enumerate(results["ids"])]
+        except Exception as e:
+            print(f"Error during search: {str(e)}")
+            return [[] for _ in query_embeddings]
 
+    def build_prompt(self, query: str, context_docs: List[Dict[str, Any]]) -> Tuple[str, str]:
+        """
+        Build the Gemini prompt for a query and its retrieved context.
+        Returns both the prompt and the context it contains.
+        """
         # Create context from retrieved documents
         context = "\n\n".join([f"File: {doc['metadata']['file_path']}\n{doc['document']}"
                              for doc in context_docs])
 
         # Prompt for Gemini
-        prompt = f"""
-        You are a helpful AI assistant specialized in answering questions about code.
-        Please answer the following question based on the code context provided.
-
-        Code context:
-        {context}
+        prompt = "".join((self.PROMPT_PRE, context, self.PROMPT_MID, query, self.PROMPT_POST))
+        return prompt, context
 
-        Question: {query}
-
-        Give a detailed and helpful response, referencing specific parts of the code where relevant.
+    def generate_response(self, query: str, context_docs: List[Dict[str, Any]]) -> Tuple[str, str]:
+        """
+        Generate a response using Gemini API based on query and retrieved context.
+        Returns both the response and the context sent to Gemini.
         """
+        if not context_docs:
+            return "No relevant code found to answer your question.", "No context available."
+
+        prompt, context = self.build_prompt(query, context_docs)
 
         # Generate response
         response = self.model.generate_content(prompt)
         return response.text, context
 
+    async def generate_response_async(self, query: str, context_docs: List[Dict[str, Any]]) -> Tuple[str, str]:
+        """
+        Like generate_response, but awaits Gemini without blocking the event loop.
+        """
+        if not context_docs:
+            return "No relevant code found to answer your question.", "No context available."
+
+        prompt, context = self.build_prompt(query, context_docs)
+
+        response = await self.model.generate_content_async(prompt)
+        return response.text, context
+
     def process_query(self, query: str, n_results: int = 5) -> Tuple[str, str]:
         """
         Process a user query by retrieving relevant code and generating a response.
         Returns both the response and the context sent to Gemini.
+        Near-duplicate queries are answered from the semantic query cache.
         """
+        # Embed the query once for both the cache lookup and the search
+        try:
+            query_embedding = np.asarray(self.embedding_function([query])[0], dtype=np.float32)
+        except Exception as e:
+            print(f"Error embedding query: {str(e)}")
+            # Without an embedding the cache can't be consulted; search()
+            # handles its own errors
+            return self.generate_response(query, self.search(query, n_results))
+        # Normalized once, so cache lookups reduce to a dot product per row
+        query_unit = query_embedding / (np.linalg.norm(query_embedding) + 1e-12)
+        cached = self.lookup_query_cache(query_unit, n_results)
+        if cached is not None:
+            return cached
+
         # Search for relevant code
-        search_results = self.search(query, n_results)
+        search_results = self.search(query, n_results, query_embedding)
 
         # Generate response based on retrieved context
         response, context = self.generate_response(query, search_results)
 
+        # A failed or empty search only yields the fallback answer; don't
+        # serve that to later queries
+        if search_results:
+            self.store_query_cache(query_unit, n_results, (response, context))
         return response, context
+
+    async def process_queries_async(self, queries: List[str], n_results: int = 5) -> List[Tuple[str, str]]:
+        """
+        Answer several queries concurrently.
+        Queries are embedded and searched in one batch off the event loop, and
+        their Gemini requests overlap. Near-duplicate queries are answered from
+        the semantic query cache. Returns one (response, context) per query.
+        """
+        loop = asyncio.get_running_loop()
+
+        # Embed all queries in one call, in a worker thread
+        try:
+            embeddings = await loop.run_in_executor(None, self.embedding_function, queries)
+        except Exception as e:
+            print(f"Error embedding queries: {str(e)}")
+            # Without embeddings the cache can't be consulted; search()
+            # handles its own errors
+            search_results = await loop.run_in_executor(
+                None, lambda: [self.search(query, n_results) for query in queries]
+            )
+            return list(await asyncio.gather(*[
+                self.generate_response_async(query, context_docs)
+                for query, context_docs in zip(queries, search_results)
+            ]))
+        query_embeddings = [np.asarray(embedding, dtype=np.float32) for embedding in embeddings]
+        query_units = [embedding / (np.linalg.norm(embedding) + 1e-12) for embedding in query_embeddings]
+
+        answers: List[Optional[Tuple[str, str]]] = [
+            self.lookup_query_cache(query_unit, n_results) for query_unit in query_units
+        ]
+        misses = [i for i, answer in enumerate(answers) if answer is None]
+        if not misses:
+            return answers
+
+        # Retrieve context for every cache miss in a single collection query
+        search_results = await loop.run_in_executor(
+            None, self.search_batch, [query_embeddings[i] for i in misses], n_results
+        )
+
+        responses = await asyncio.gather(*[
+            self.generate_response_async(queries[i], context_docs)
+            for i, context_docs in zip(misses, search_results)
+        ])
+
+        for i, context_docs, response in zip(misses, search_results, responses):
+            if context_docs:
+                self.store_query_cache(query_units[i], n_results, response)
+            answers[i] = response
+        return answers
+
+    async def process_query_async(self, query: str, n_results: int = 5) -> Tuple[str, str]:
+        """
+        Like process_query, but awaits embedding, search and Gemini without
+        blocking the event loop.
+        """
+        return (await self.process_queries_async([query], n_results))[0]